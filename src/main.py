@@ -1,55 +1,372 @@
 from __future__ import annotations
 
 import asyncio
+import functools
+import random
+import re
+from collections.abc import Mapping
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Literal
 from urllib.parse import quote
 
 import httpx
+import orjson
 from apify import Actor
 
+if TYPE_CHECKING:
+    from apify import ProxyConfiguration, ProxyInfo
+    from playwright.async_api import Browser, Page, Playwright, Route
+
 PROXY_GROUP = "RESIDENTIAL"
 PROXY_COUNTRY = "FR"
 API_BASE = "https://api.adopte.app/api/v4"
+LOGIN_PAGE = "https://www.adopte.app/"
+LOGIN_ENDPOINT = "https://www.adopte.app/auth/login"
+
+# sent on every call via the client defaults, never rebuilt per request;
+# Content-Type is left to httpx, which sets the form type whenever data= is passed
+BASE_HEADERS: Mapping[str, str] = MappingProxyType(
+    {
+        "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:140.0) Gecko/20100101 Firefox/140.0",
+        "Accept": "application/json, text/plain, */*",
+        "X-Platform": "web",
+    }
+)
+
+LoginMode = Literal["auto", "http", "browser"]
+LOGIN_MODES: tuple[LoginMode, ...] = ("auto", "http", "browser")
+
+CHROMIUM_ARGS = [
+    "--disable-gpu",
+    "--no-sandbox",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-translate",
+    "--metrics-recording-only",
+    "--mute-audio",
+    "--no-first-run",
+    "--safebrowsing-disable-auto-update",
+    "--disable-background-timer-throttling",
+    "--disable-renderer-backgrounding",
+]
+# the login form needs none of these, each one is a round-trip through the proxy
+BLOCKED_RESOURCES = frozenset({"image", "font", "media", "stylesheet"})
+# resolves window._tokenReady the moment the page assigns a non-empty
+# apiRefreshToken (a logged-out page may set it to "" or null first)
+TOKEN_READY_SCRIPT = """
+window._tokenReady = new Promise((resolve) => {
+  let value;
+  Object.defineProperty(window, "apiRefreshToken", {
+    configurable: true,
+    get: () => value,
+    set: (v) => { value = v; if (v) resolve(v); },
+  });
+});
+"""
+
+# matched on the raw body so the login page never has to be decoded
+_TOKEN_RE = re.compile(rb'apiRefreshToken\s*=\s*"([^"]+)"')
+_TOKEN_MARKER = b"apiRefreshToken"
+# stop reading a login page that grows past this without carrying the token
+MAX_LOGIN_BODY = 512 * 1024
+
+# transient proxy / upstream hiccups; 4xx auth failures are never retried
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+RETRY_EXCEPTIONS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httpx.ProxyError,  # non-2xx answer to the proxy CONNECT
+    httpx.ReadError,  # tunnel reset mid-response
+    httpx.ReadTimeout,
+    httpx.RemoteProtocolError,
+)
+
+# created once, every run only asks it for a fresh proxy_info
+_proxy_cfg: ProxyConfiguration | None = None
+_proxy_lock = asyncio.Lock()
+
+# one client shared by every call of a run so its connection pool is reused;
+# main() closes it when the run ends (an Actor run is one process anyway)
+_client: httpx.AsyncClient | None = None
+_client_lock = asyncio.Lock()
+# fire-and-forget warm-ups, referenced here so they are not garbage collected
+_warmups: set[asyncio.Task] = set()
+# requests tagged with this extension skip retries: their result is thrown away
+WARMUP_EXTENSION = "adopte_warmup"
+WARMUP_TIMEOUT = 5.0
+
+# only started when the plain HTTP login cannot get the token
+_playwright: Playwright | None = None
+_browser: Browser | None = None
+_browser_lock = asyncio.Lock()
 
 
 class RetryTransport(httpx.AsyncBaseTransport):
-    def __init__(self, retries=3, backoff=0.5):
+    def __init__(
+        self,
+        retries=3,
+        backoff=0.5,
+        max_delay=30.0,
+        proxy: str | None = None,
+        limits: httpx.Limits | None = None,
+        http2: bool = False,
+    ):
+        if retries < 1:
+            raise ValueError(f"retries must be at least 1, got {retries}")
         self.retries = retries
         self.backoff = backoff
-        self._transport = httpx.AsyncHTTPTransport()
+        self.max_delay = max_delay
+        # proxy + pool live on the wrapped transport: passing `proxy=` to the client
+        # would mount a separate transport that bypasses the retries entirely
+        self._transport = httpx.AsyncHTTPTransport(
+            proxy=proxy,
+            limits=limits or httpx.Limits(max_connections=10),
+            http2=http2,
+        )
 
     async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
-        last_exc = None
-        for attempt in range(self.retries):
+        # warm-ups are thrown away: no retries
+        if request.extensions.get(WARMUP_EXTENSION):
+            return await self._transport.handle_async_request(request)
+        attempt = 0
+        while True:
+            last_attempt = attempt == self.retries - 1
             try:
                 response = await self._transport.handle_async_request(request)
-                if response.status_code < 500:
-                    return response  # only retry on server errors
             except httpx.RequestError as exc:
-                last_exc = exc
-            await asyncio.sleep(self.backoff * (2**attempt))  # exponential backoff
-        if last_exc:
-            raise last_exc
-        return response  # last response if not successful
+                if last_attempt or not isinstance(exc, RETRY_EXCEPTIONS):
+                    raise
+            else:
+                if last_attempt or response.status_code not in RETRY_STATUSES:
+                    return response
+                await response.aclose()
+            # full jitter keeps concurrent runs on the same proxy pool from
+            # retrying in lockstep
+            delay = min(self.max_delay, self.backoff * (2**attempt))
+            await asyncio.sleep(random.uniform(0, delay))
+            attempt += 1
 
+    async def aclose(self) -> None:
+        await self._transport.aclose()
 
-async def get_client() -> httpx.AsyncClient:
-    proxy_cfg = await Actor.create_proxy_configuration(
-        groups=[PROXY_GROUP], country_code=PROXY_COUNTRY
-    )
+
+async def get_proxy() -> ProxyInfo:
+    global _proxy_cfg
+    async with _proxy_lock:
+        if _proxy_cfg is None:
+            _proxy_cfg = await Actor.create_proxy_configuration(
+                groups=[PROXY_GROUP], country_code=PROXY_COUNTRY
+            )
 
     # ― Obtain proxy components ―
-    proxy_info = (
-        await proxy_cfg.new_proxy_info()
-    )  # gives hostname, port, username, password
+    return await _proxy_cfg.new_proxy_info()  # gives hostname, port, username, password
+
+
+@functools.lru_cache(maxsize=8)
+def proxy_url(hostname: str, port: int, username: str, password: str) -> str:
+    return f"http://{quote(username)}:{quote(password)}@{hostname}:{port}"
+
+
+async def get_client(
+    headers: Mapping[str, str] = BASE_HEADERS, pool_connections: int = 20
+) -> httpx.AsyncClient:
+    """Return the shared client, creating it on first use."""
+    global _client
+    async with _client_lock:
+        if _client is not None and not _client.is_closed:
+            return _client
+
+        proxy_info = await get_proxy()
+        url = proxy_url(
+            proxy_info.hostname,
+            proxy_info.port,
+            proxy_info.username,
+            proxy_info.password,
+        )
+
+        timeout = httpx.Timeout(20.0, connect=10.0)
+        limits = httpx.Limits(
+            max_connections=pool_connections,
+            max_keepalive_connections=pool_connections,
+            keepalive_expiry=60,
+        )
+        transport = RetryTransport(
+            retries=5, backoff=1, proxy=url, limits=limits, http2=True
+        )
+
+        # one pooled client for every call so the proxy tunnel + TLS session are reused
+        _client = httpx.AsyncClient(
+            headers=headers, timeout=timeout, transport=transport
+        )
+        return _client
+
+
+async def close_client() -> None:
+    global _client
+    pending = list(_warmups)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    async with _client_lock:
+        if _client is not None:
+            await _client.aclose()
+            _client = None
+
+
+async def get_browser(headless: bool = True) -> Browser:
+    """Return the process-wide Chromium, launching it on first use."""
+    global _playwright, _browser
+    async with _browser_lock:
+        if _browser is not None and _browser.is_connected():
+            return _browser
+
+        # imported lazily so the HTTP-only path never pays for Playwright
+        from playwright.async_api import async_playwright
+
+        if _playwright is None:
+            _playwright = await async_playwright().start()
+        _browser = await _playwright.chromium.launch(
+            headless=headless, args=CHROMIUM_ARGS
+        )
+        return _browser
+
+
+async def close_browser() -> None:
+    global _playwright, _browser
+    async with _browser_lock:
+        if _browser is not None:
+            await _browser.close()
+            _browser = None
+        if _playwright is not None:
+            await _playwright.stop()
+            _playwright = None
+
+
+async def _stream_login(
+    client: httpx.AsyncClient, payload: dict[str, str]
+) -> str | None:
+    async with client.stream(
+        "POST", LOGIN_ENDPOINT, data=payload, follow_redirects=True
+    ) as resp:
+        if resp.headers.get("cf-mitigated") == "challenge":
+            Actor.log.warning("Login page answered with a JS challenge ❗️")
+            return None
+        resp.raise_for_status()
 
-    proxy_url = f"http://{quote(proxy_info.username)}:{quote(proxy_info.password)}@{proxy_info.hostname}:{proxy_info.port}"
+        # extract apiRefreshToken from response (html) as it arrives and hang up
+        # as soon as it is there, the rest of the page is never downloaded
+        buf = bytearray()
+        pos = 0
+        match = None
+        async for chunk in resp.aiter_bytes():
+            buf.extend(chunk)
+            match = _TOKEN_RE.search(buf, pos)
+            if match is not None or len(buf) >= MAX_LOGIN_BODY:
+                break
+            # only rescan from the marker (or the tail that could hold half of it)
+            marker = buf.find(_TOKEN_MARKER, pos)
+            pos = marker if marker != -1 else max(0, len(buf) - len(_TOKEN_MARKER))
 
-    timeout = httpx.Timeout(20.0, connect=10.0)
-    transport = RetryTransport(retries=5, backoff=1)
+        Actor.log.debug("✅ Login status %s, %s bytes read", resp.status_code, len(buf))
 
-    client = httpx.AsyncClient(timeout=timeout, transport=transport, proxy=proxy_url)
+    if match is None:
+        return None
+    return match.group(1).decode("utf-8")
 
-    return client
+
+async def login_http(client: httpx.AsyncClient, payload: dict[str, str]) -> str | None:
+    """Log in with a plain form POST and scrape apiRefreshToken from the HTML.
+
+    Returns None when the page does not carry the token (JS challenge, login
+    rendered client-side, ...) so the caller can fall back to a real browser.
+    """
+    warm_up(client)
+    return await _stream_login(client, payload)
+
+
+async def _warm_up(client: httpx.AsyncClient) -> None:
+    try:
+        await client.head(
+            f"{API_BASE}/authtokens",
+            timeout=WARMUP_TIMEOUT,
+            extensions={WARMUP_EXTENSION: True},
+        )
+    except httpx.HTTPError as exc:
+        Actor.log.debug("API warm-up failed: %s", exc)
+
+
+def warm_up(client: httpx.AsyncClient) -> None:
+    """Open the api host's proxy tunnel + TLS session in the background.
+
+    Never awaited by the login: one short, unretried HEAD whose response is
+    thrown away, so it can neither delay nor fail the run.
+    """
+    task = asyncio.create_task(_warm_up(client))
+    _warmups.add(task)
+    task.add_done_callback(_warmups.discard)
+
+
+async def _block_heavy_resources(route: Route) -> None:
+    if route.request.resource_type in BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _wait_for_token(page: Page) -> str:
+    from playwright.async_api import Error as PlaywrightError
+
+    while True:
+        try:
+            return await page.evaluate("window._tokenReady")
+        except PlaywrightError as exc:
+            # the form submit navigates away, the new document gets its own
+            # promise from the init script so just await that one
+            if "Execution context was destroyed" not in str(exc):
+                raise
+
+
+async def login_browser(email: str, password: str, headless: bool) -> str | None:
+    """Log in through Chromium and read apiRefreshToken from `window`.
+
+    Returns None when the browser login fails or times out so the caller's
+    usual failure path runs instead of a traceback.
+    """
+    from playwright.async_api import Error as PlaywrightError
+
+    try:
+        return await _login_in_browser(email, password, headless)
+    except (PlaywrightError, asyncio.TimeoutError) as exc:
+        Actor.log.error("Browser login failed: %s", exc)
+        return None
+
+
+async def _login_in_browser(email: str, password: str, headless: bool) -> str:
+    proxy_info = await get_proxy()
+    browser = await get_browser(headless=headless)
+    # the proxy is set per context so the browser itself can be reused
+    context = await browser.new_context(
+        proxy={
+            "server": f"http://{proxy_info.hostname}:{proxy_info.port}",
+            "username": proxy_info.username,
+            "password": proxy_info.password,
+        },
+        viewport={"width": 800, "height": 600},
+    )
+    await context.route("**/*", _block_heavy_resources)
+    await context.add_init_script(TOKEN_READY_SCRIPT)
+    try:
+        page = await context.new_page()
+        await page.goto(LOGIN_PAGE, wait_until="domcontentloaded")
+        await page.click("#btn-display-login")
+        await page.fill('input[name="username"]', email)
+        await page.fill('input[name="password"]', password)
+        await page.click('button[type="submit"]')
+        return await asyncio.wait_for(_wait_for_token(page), timeout=45)
+    finally:
+        await context.close()
 
 
 async def main() -> None:
@@ -64,40 +381,39 @@ async def main() -> None:
             await Actor.fail("Input must contain email and password ❗️")
             return
 
-        auth_endpoint = "https://www.adopte.app/auth/login"
-        headers = {
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:140.0) Gecko/20100101 Firefox/140.0",
-            "Accept": "application/json, text/plain, */*",
-            "Content-Type": "application/x-www-form-urlencoded",
-            "X-Platform": "web",
-        }
+        headless: bool = inp.get("headless", True)
+        mode: LoginMode = inp.get("loginMode", "auto")
+        if mode not in LOGIN_MODES:
+            await Actor.fail(f"loginMode must be one of {', '.join(LOGIN_MODES)} ❗️")
+            return
+
         payload = {
             "username": email,
             "password": password,
             "remember": "true",
         }
 
-        async with await get_client() as client:
-            resp = await client.post(
-                auth_endpoint, headers=headers, data=payload, follow_redirects=True
-            )
-            resp.raise_for_status()
-            Actor.log.info(f"✅ Status: {resp.status_code}")
-
-            # extract apiRefreshToken from response (html)
+        client = await get_client()
+        try:
             api_refresh_token: str | None = None
-            if "apiRefreshToken" in resp.text:
-                start_index = resp.text.index("apiRefreshToken") + len(
-                    'apiRefreshToken = "'
-                )
-                end_index = resp.text.index('",', start_index)
-                api_refresh_token = resp.text[start_index:end_index]
-                Actor.log.info("apiRefreshToken captured from response ✅")
-            else:
+            if mode != "browser":
+                try:
+                    api_refresh_token = await login_http(client, payload)
+                except httpx.HTTPError as exc:
+                    Actor.log.error("HTTP login failed: %s", exc)
+            if api_refresh_token is None and mode != "http":
+                if mode == "auto":
+                    Actor.log.warning(
+                        "HTTP login gave no apiRefreshToken, falling back to browser ❗️"
+                    )
+                # Playwright is only imported on this path
+                api_refresh_token = await login_browser(email, password, headless)
+            if not api_refresh_token:
                 Actor.log.error("apiRefreshToken not found in response ❗️")
                 # exit with failure
                 await Actor.fail("apiRefreshToken not found in response ❗️")
                 return
+            Actor.log.info("apiRefreshToken captured from response ✅")
 
             # ────────────────────────────────────────────────────────────
             # requests → /authtokens & /boost
@@ -109,15 +425,22 @@ async def main() -> None:
             }
 
             # Using httpx client instead of requests for consistency
-            resp = await client.post(
-                "https://api.adopte.app/api/v4/authtokens",
-                headers=headers,
-                data=data,
+            try:
+                resp = await client.post(f"{API_BASE}/authtokens", data=data)
+                resp.raise_for_status()
+            except httpx.HTTPError as exc:
+                Actor.log.error("/authtokens request failed: %s", exc)
+                await Actor.fail(
+                    "Could not exchange apiRefreshToken for an auth token ❗️"
+                )
+                return
+            Actor.log.debug(
+                "✅ /authtokens status %s, %s bytes",
+                resp.status_code,
+                len(resp.content),
             )
-            resp.raise_for_status()
-            Actor.log.info(f"✅ Status: {resp.status_code}")
 
-            auth_token: str = resp.json()["data"][0]["id"]
+            auth_token: str = orjson.loads(resp.content)["data"][0]["id"]
             Actor.log.info("Auth token obtained ✅")
 
             # Push result
@@ -130,3 +453,6 @@ async def main() -> None:
                 }
             )
             Actor.log.info("Actor finished 🎉")
+        finally:
+            await close_client()
+            await close_browser()
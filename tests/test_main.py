@@ -0,0 +1,164 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from src import main
+
+
+def make_client(handler, **kwargs) -> httpx.AsyncClient:
+    transport = main.RetryTransport(**kwargs)
+    transport._transport = httpx.MockTransport(handler)
+    return httpx.AsyncClient(transport=transport)
+
+
+def test_login_does_not_wait_for_failing_warm_up():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.method == "HEAD":
+            return httpx.Response(503)
+        return httpx.Response(200, content=b'x apiRefreshToken = "tok", y')
+
+    async def run():
+        client = make_client(handler, retries=5, backoff=1)
+        started = time.monotonic()
+        token = await main.login_http(client, {"username": "u", "password": "p"})
+        elapsed = time.monotonic() - started
+        await asyncio.gather(*main._warmups)
+        await client.aclose()
+        return token, elapsed
+
+    token, elapsed = asyncio.run(run())
+    assert token == "tok"
+    assert elapsed < 1
+
+
+def test_warm_up_is_sent_once_without_retries():
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.method)
+        return httpx.Response(503)
+
+    async def run():
+        client = make_client(handler, retries=5, backoff=1)
+        main.warm_up(client)
+        await asyncio.gather(*main._warmups)
+        await client.aclose()
+
+    asyncio.run(run())
+    assert calls == ["HEAD"]
+
+
+def test_retry_transport_rejects_zero_retries():
+    with pytest.raises(ValueError):
+        main.RetryTransport(retries=0)
+
+
+def test_retries_transient_failures_but_not_auth_failures():
+    outcomes = {
+        "/flaky": [503, 502, 200],
+        "/proxy": [
+            httpx.ProxyError("502 Bad Gateway"),
+            httpx.ReadError("tunnel reset"),
+            200,
+        ],
+        "/auth": [401, 200],
+    }
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url.path)
+        outcome = outcomes[request.url.path].pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return httpx.Response(outcome)
+
+    async def run():
+        client = make_client(handler, retries=5, backoff=0.001)
+        flaky = await client.get("http://www.adopte.app/flaky")
+        proxy = await client.get("http://www.adopte.app/proxy")
+        auth = await client.get("http://www.adopte.app/auth")
+        await client.aclose()
+        return flaky, proxy, auth
+
+    flaky, proxy, auth = asyncio.run(run())
+    assert flaky.status_code == 200
+    assert proxy.status_code == 200
+    assert auth.status_code == 401
+    assert calls == ["/flaky"] * 3 + ["/proxy"] * 3 + ["/auth"]
+
+
+def test_form_content_type_only_on_form_posts():
+    seen = {}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        seen[request.method] = request.headers.get("content-type")
+        return httpx.Response(200)
+
+    async def run():
+        transport = main.RetryTransport()
+        transport._transport = httpx.MockTransport(handler)
+        async with httpx.AsyncClient(
+            headers=main.BASE_HEADERS, transport=transport
+        ) as client:
+            await client.head(f"{main.API_BASE}/authtokens")
+            await client.post(f"{main.API_BASE}/authtokens", data={"type": "2"})
+
+    asyncio.run(run())
+    assert seen["HEAD"] is None
+    assert seen["POST"] == "application/x-www-form-urlencoded"
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    def __init__(self, body: bytes, chunk_size: int):
+        self.body = body
+        self.chunk_size = chunk_size
+        self.sent = 0
+
+    async def __aiter__(self):
+        for start in range(0, len(self.body), self.chunk_size):
+            chunk = self.body[start : start + self.chunk_size]
+            self.sent += len(chunk)
+            yield chunk
+
+
+def stream_login(stream: ChunkedStream) -> str | None:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, stream=stream)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await main._stream_login(client, {"username": "u"})
+
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 16, 17, 64])
+def test_stream_login_finds_token_split_across_chunks(chunk_size):
+    body = b"<html>" + b"x" * 50 + b'<script>apiRefreshToken = "tok.123",</script>'
+    assert stream_login(ChunkedStream(body, chunk_size)) == "tok.123"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 13, 4096])
+def test_stream_login_skips_marker_without_assignment(chunk_size):
+    body = (
+        b"<script>var state = {apiRefreshToken: null};</script>"
+        + b"y" * 200
+        + b'<script>window.apiRefreshToken = "real-token", x</script>'
+    )
+    assert stream_login(ChunkedStream(body, chunk_size)) == "real-token"
+
+
+def test_stream_login_stops_at_max_body_without_token():
+    body = b"z" * (main.MAX_LOGIN_BODY * 2)
+    stream = ChunkedStream(body, 64 * 1024)
+    assert stream_login(stream) is None
+    assert stream.sent <= main.MAX_LOGIN_BODY + stream.chunk_size
+
+
+def test_stream_login_stops_reading_once_token_found():
+    body = b'apiRefreshToken = "early"' + b"z" * (256 * 1024)
+    stream = ChunkedStream(body, 1024)
+    assert stream_login(stream) == "early"
+    assert stream.sent == 1024